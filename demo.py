@@ -1,3 +1,4 @@
+import torch
 import toml
 from argparse import ArgumentParser
 from os.path import join
@@ -5,6 +6,10 @@ from os.path import join
 from games.carracing import RacingNet, CarRacing
 from ppo import PPO
 
+# Input shapes are fixed for the whole run, so let cuDNN autotune once and allow TF32
+torch.backends.cudnn.benchmark = True
+torch.set_float32_matmul_precision("high")
+
 CONFIG_FILE = "config.toml"
 
 
@@ -28,7 +33,12 @@ def main():
     cfg = load_config()
     args = parse_args()
 
-    env = CarRacing(frame_skip=0, frame_stack=4, human_render=True)
+    env = CarRacing(
+        frame_skip=0,
+        frame_stack=4,
+        human_render=True,
+        log_interval=cfg.get("log_interval", 1),
+    )
     net = RacingNet(env.observation_space.shape, env.action_space.shape)
 
     ppo = PPO(
@@ -46,6 +56,7 @@ def main():
         horizon=cfg["horizon"],
         save_dir=cfg["save_dir"],
         save_interval=cfg["save_interval"],
+        mixed_precision=cfg.get("mixed_precision", False),
     )
 
     ppo.load(args.ckpt)
@@ -40,3 +40,6 @@ class BipedalNet(nn.Module):
 
         return value, alpha, beta
 
+    def value(self, x):
+        # Critic only, over the same backbone features the actor uses
+        return self.critic(self.backbone(x))
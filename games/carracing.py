@@ -3,10 +3,11 @@ from torch import nn
 import gymnasium as gym
 from gymnasium.spaces import Box
 import numpy as np
-from collections import deque
 
 from logger import Logger
 
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
 
 class RacingNet(nn.Module):
     def __init__(self, state_dim, action_dim) -> None:
@@ -52,6 +53,10 @@ class RacingNet(nn.Module):
 
         return value, alpha, beta
 
+    def value(self, x):
+        # Critic only, over the same conv features the actor uses
+        return self.critic(self.conv(x))
+
     def _get_conv_out(self, shape):
         x = torch.zeros(1, *shape)
         x = self.conv(x)
@@ -59,18 +64,44 @@ class RacingNet(nn.Module):
         return int(np.prod(x.size()))
 
 
+class Grayscale(nn.Module):
+    def __init__(self) -> None:
+        super().__init__()
+
+        # grayscale weights, laid out to broadcast over a CHW frame
+        self.register_buffer("weights", torch.tensor([0.299, 0.587, 0.114]).view(3, 1, 1))
+
+    def forward(self, frame: torch.Tensor) -> torch.Tensor:
+        # HWC uint8 RGB frame -> HW uint8 grayscale frame
+        x = frame.permute(2, 0, 1).to(torch.float32)
+        return (x * self.weights).sum(0).round().to(torch.uint8)
+
+
 class CarRacing(gym.Wrapper):
-    def __init__(self, frame_skip=0, frame_stack=4, human_render = False):
+    def __init__(self, frame_skip=0, frame_stack=4, human_render = False, log_interval=1):
         self.env = gym.make("CarRacing-v3", render_mode='human' if human_render else 'rgb_array')
         super().__init__(self.env)
 
         self.frame_skip = frame_skip
         self.frame_stack = frame_stack
+        self.log_interval = log_interval
 
         self.action_space = Box(low=0, high=1, shape=(2,))
-        self.observation_space = Box(low=0, high=1, shape=(frame_stack, 96, 96))
+        self.observation_space = Box(
+            low=0, high=255, shape=(frame_stack, 96, 96), dtype=np.uint8
+        )
+
+        # ring buffer of the last frames, frame_head is the slot of the oldest one
+        self.frame_buf = torch.empty((frame_stack, 96, 96), dtype=torch.uint8, device=device)
+        self.frame_head = 0
 
-        self.frame_buf = deque(maxlen=frame_stack)
+        # compiled once so each frame is converted without per-op Python dispatch
+        self.grayscale = torch.jit.script(Grayscale()).to(device)
+
+        # pinned staging buffer so frames are copied to the device asynchronously
+        if device.type == "cuda":
+            self.frame_host = torch.empty((96, 96, 3), dtype=torch.uint8, pin_memory=True)
+            self.frame_copied = torch.cuda.Event()
 
         self.t = 0
         self.last_reward_step = 0
@@ -80,36 +111,47 @@ class CarRacing(gym.Wrapper):
         self.logger = Logger("logs/episode_reward.csv")
 
     def preprocess(self, original_action):
-        original_action = original_action * 2 - 1  # map from [0, 1] to [-1, 1]
+        steer, throttle = original_action * 2 - 1  # map from [0, 1] to [-1, 1]
 
-        action = np.zeros(3)
+        # Separate acceleration and braking, in the float32 layout the env expects
+        return np.array([steer, max(0, throttle), max(0, -throttle)], dtype=np.float32)
 
-        action[0] = original_action[0]
+    def postprocess(self, original_observation):
+        # shares memory with the env's uint8 frame, no host-side copy or cast
+        observation = torch.from_numpy(original_observation)
 
-        # Separate acceleration and braking
-        action[1] = max(0, original_action[1])
-        action[2] = max(0, -original_action[1])
+        if device.type == "cuda":
+            # the previous frame must have left the staging buffer before it is overwritten
+            self.frame_copied.synchronize()
 
-        return action
+            self.frame_host.copy_(observation)
+            observation = self.frame_host.to(device, non_blocking=True)
 
-    def postprocess(self, original_observation):
-        # convert to grayscale
-        grayscale = np.array([0.299, 0.587, 0.114])
-        observation = np.dot(original_observation, grayscale) / 255.0
+            self.frame_copied.record()
 
-        return observation
+        # convert to uint8 grayscale on the device
+        return self.grayscale(observation)
 
     def shape_reward(self, reward):
         return np.clip(reward, -1, 1)
 
+    def push_frame(self, frame):
+        self.frame_buf[self.frame_head].copy_(frame)
+        self.frame_head = (self.frame_head + 1) % self.frame_stack
+
     def get_observation(self):
-        return np.array(self.frame_buf)
+        # oldest frame first; roll returns a fresh tensor, so the observation
+        # is not overwritten by later frames
+        return torch.roll(self.frame_buf, shifts=-self.frame_head, dims=0)
 
     def reset(self):
         self.logger.log("Episode", self.n_episodes)
         self.logger.log("Reward", self.total_reward)
         self.logger.write()
-        self.logger.print()
+
+        # console output is slow next to the env step, so only print every few episodes
+        if self.n_episodes % self.log_interval == 0:
+            self.logger.print()
 
         self.t = 0
         self.last_reward_step = 0
@@ -119,8 +161,8 @@ class CarRacing(gym.Wrapper):
         # Diff
         first_frame = self.postprocess(self.env.reset()[0])
 
-        for _ in range(self.frame_stack):
-            self.frame_buf.append(first_frame)
+        self.frame_buf.copy_(first_frame.expand_as(self.frame_buf))
+        self.frame_head = 0
 
         return self.get_observation()
 
@@ -146,7 +188,7 @@ class CarRacing(gym.Wrapper):
         reward = total_reward / (self.frame_skip + 1)
 
         new_frame = self.postprocess(new_frame)
-        self.frame_buf.append(new_frame)
+        self.push_frame(new_frame)
 
         return self.get_observation(), reward, done, info
 
@@ -7,6 +7,10 @@ from games.carracing import RacingNet, CarRacing
 from games.bipedal import BipedalNet, BipedalWalker
 from ppo import PPO
 
+# Input shapes are fixed for the whole run, so let cuDNN autotune once and allow TF32
+torch.backends.cudnn.benchmark = True
+torch.set_float32_matmul_precision("high")
+
 CONFIG_FILE = "config.toml"
 
 
@@ -27,7 +31,7 @@ def main():
     cfg = load_config()
     seed(cfg["seed"])
 
-    # env = CarRacing(frame_skip=1, frame_stack=4,)
+    # env = CarRacing(frame_skip=1, frame_stack=4, log_interval=cfg.get("log_interval", 1))
     # net = RacingNet(env.observation_space.shape, env.action_space.shape)
 
     env = BipedalWalker()
@@ -48,6 +52,7 @@ def main():
         horizon=cfg["horizon"],
         save_dir=cfg["save_dir"],
         save_interval=cfg["save_interval"],
+        mixed_precision=cfg.get("mixed_precision", False),
     )
     ppo.train()
 
@@ -1,20 +1,33 @@
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 
 
 class Memory(Dataset):
-    def __init__(self, states, actions, log_probs, rewards, advantages, values) -> None:
+    def __init__(
+        self, capacity, state_shape, action_shape, device, state_dtype=torch.float32
+    ) -> None:
         super().__init__()
 
-        self.states = states
-        self.actions = actions
-        self.log_probs = log_probs
-        self.rewards = rewards
-        self.advantages = advantages
-        self.values = values
+        # One preallocated tensor per field, written in place as the rollout runs
+        self.states = torch.empty((capacity, *state_shape), dtype=state_dtype, device=device)
+        self.actions = torch.empty((capacity, *action_shape), device=device)
+        self.log_probs = torch.empty(capacity, device=device)
+        self.rewards = torch.empty(capacity, device=device)
+        self.advantages = torch.empty(capacity, device=device)
+        self.values = torch.empty(capacity, device=device)
+        self.dones = torch.empty(capacity, device=device)
+
+        # Rewards and done flags arrive from the env as Python scalars; collect them on
+        # the host and copy them to the device in one go instead of once per step
+        self.host_rewards = np.empty(capacity, dtype=np.float32)
+        self.host_dones = np.empty(capacity, dtype=np.float32)
+
+        self.capacity = capacity
+        self.size = 0
 
     def __len__(self):
-        return len(self.states)
+        return self.size
 
     def __getitem__(self, idx):
         return (
@@ -25,3 +38,31 @@ class Memory(Dataset):
             self.advantages[idx],
             self.values[idx],
         )
+
+    def clear(self):
+        self.size = 0
+
+    def push(self, state, action, log_prob, reward, value, done):
+        idx = self.size
+
+        self.states[idx] = state
+        self.actions[idx] = action
+        self.log_probs[idx] = log_prob
+        self.values[idx] = value
+        self.host_rewards[idx] = reward
+        self.host_dones[idx] = done
+
+        self.size += 1
+
+    def flush(self):
+        size = self.size
+
+        self.rewards[:size].copy_(torch.from_numpy(self.host_rewards[:size]))
+        self.dones[:size].copy_(torch.from_numpy(self.host_dones[:size]))
+
+    def batches(self, batch_size):
+        # Shuffled minibatches gathered with one index per field, no per-sample collation
+        indices = torch.randperm(self.size, device=self.states.device)
+
+        for start in range(0, self.size, batch_size):
+            yield self[indices[start : start + batch_size]]
@@ -5,9 +5,10 @@ import numpy as np
 import torch
 from torch import nn, optim
 from torch.distributions import Beta
-from torch.utils.data import DataLoader
 from os import path
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
 
 from memory import Memory
 from logger import Logger
@@ -32,6 +33,7 @@ class PPO:
         entropy_coef: float = 0.01,
         save_dir: str = "ckpt",
         save_interval: int = 100,
+        mixed_precision: bool = False,
     ) -> None:
         self.env = env
         self.net = net.to(device)
@@ -48,9 +50,32 @@ class PPO:
         self.entropy_coef = entropy_coef
         self.save_dir = save_dir
         self.save_interval = save_interval
+        # bf16 autocast for the rollout forward passes, only worthwhile on CUDA. The
+        # stored log probs and values then carry bf16 error, so the first PPO ratios
+        # are no longer exactly 1; keep it off unless that trade-off is wanted
+        self.mixed_precision = mixed_precision and device.type == "cuda"
+
+        # Side stream for copying actions to the host while other rollout work runs
+        self.transfer_stream = torch.cuda.Stream() if device.type == "cuda" else None
 
         self.optim = optim.Adam(self.net.parameters(), lr=self.lr)
+        self.value_loss_fn = nn.MSELoss()
         self.logger = Logger("logs/training.csv")
+        # uint8 observations (frames) are kept quantized in memory
+        self.state_dtype = (
+            torch.uint8 if env.observation_space.dtype == np.uint8 else torch.float32
+        )
+        self.memory = Memory(
+            horizon,
+            env.observation_space.shape,
+            env.action_space.shape,
+            device,
+            state_dtype=self.state_dtype,
+        )
+
+        # Single background worker for checkpoint writes; errors surface in wait_for_save
+        self.save_executor = ThreadPoolExecutor(max_workers=1)
+        self.pending_save = None
 
         self.state = self._to_tensor(env.reset())
         self.alpha = 1.0
@@ -59,16 +84,12 @@ class PPO:
         for step in range(self.num_steps):
             self._set_step_params(step)
             # Collect episode trajectory for the horizon length
-            with torch.no_grad():
-                memory = self.collect_trajectory(self.horizon)
+            memory = self.collect_trajectory(self.horizon)
 
-            self.logger.log("Total Reward", memory.rewards.sum().item())
+            self.logger.log("Total Reward", memory.rewards[: len(memory)].sum().item())
 
-            memory_loader = DataLoader(
-                memory, batch_size=self.batch_size, shuffle=True,
-            )
-
-            avg_loss = 0.0
+            num_batches = ceil(len(memory) / self.batch_size)
+            avg_loss = torch.zeros((), device=device)
 
             for epoch in range(self.epochs_per_step):
                 for (
@@ -78,21 +99,23 @@ class PPO:
                     rewards,
                     advantages,
                     values,
-                ) in memory_loader:
+                ) in memory.batches(self.batch_size):
                     loss, _, _, _ = self.train_batch(
                         states, actions, log_probs, rewards, advantages, values
                     )
 
                     avg_loss += loss
 
-            self.logger.log("Loss", avg_loss / len(memory_loader))
+            # Single device sync for the loss, once per step
+            self.logger.log("Loss", avg_loss.item() / num_batches)
             self.logger.print(f"Step {step}")
             self.logger.write()
 
             if step % self.save_interval == 0:
-                self.save(join(self.save_dir, f"net_{step}.pth"))
+                self.save_async(join(self.save_dir, f"net_{step}.pth"))
 
         # save final model
+        self.wait_for_save()
         self.save(join(self.save_dir, f"net_final.pth"))
         self.logger.close()
 
@@ -107,10 +130,10 @@ class PPO:
     ):
         self.optim.zero_grad()
 
-        values, alpha, beta = self.net(states)
+        values, alpha, beta = self.net(self._dequantize(states))
         values = values.squeeze(1)
 
-        policy = Beta(alpha, beta)
+        policy = Beta(alpha, beta, validate_args=False)
         entropy = policy.entropy().mean()
         log_probs = policy.log_prob(old_actions).sum(dim=1)
 
@@ -124,7 +147,7 @@ class PPO:
         with torch.no_grad():
             value_target = advantages + old_values  # V_t = (Q_t - V_t) + V_t
 
-        value_loss = nn.MSELoss()(values, value_target)
+        value_loss = self.value_loss_fn(values, value_target)
 
         entropy_loss = -entropy
 
@@ -138,21 +161,41 @@ class PPO:
 
         self.optim.step()
 
-        return loss.item(), policy_loss.item(), value_loss.item(), entropy_loss.item()
+        # Detached device tensors; callers sync only when they actually log them
+        return (
+            loss.detach(),
+            policy_loss.detach(),
+            value_loss.detach(),
+            entropy_loss.detach(),
+        )
 
+    @torch.inference_mode()
     def collect_trajectory(self, num_steps: int, delay_ms: int = 0) -> Memory:
-        states, actions, rewards, log_probs, values, dones = [], [], [], [], [], []
+        memory = self.memory
+
+        if num_steps > memory.capacity:
+            raise ValueError(
+                f"num_steps ({num_steps}) exceeds the rollout capacity ({memory.capacity}), "
+                "increase horizon"
+            )
+
+        memory.clear()
 
         for t in range(num_steps):
             # Run one step of the environment based on the current policy
-            value, alpha, beta = self.net(self.state)
-            value, alpha, beta = value.squeeze(0), alpha.squeeze(0), beta.squeeze(0)
+            value, alpha, beta = self._rollout_forward(self.state)
+            value, alpha, beta = value.squeeze(), alpha.squeeze(0), beta.squeeze(0)
 
-            policy = Beta(alpha, beta)
+            # alpha, beta > 1 by construction, so skip the validation checks that
+            # allocate temporaries and sync with the device on every step
+            policy = Beta(alpha, beta, validate_args=False)
             action = policy.sample()
+            action_host = self._start_host_copy(action)
             log_prob = policy.log_prob(action).sum()
 
-            next_state, reward, done, _ = self.env.step(action.cpu().numpy())
+            next_state, reward, done, _ = self.env.step(
+                self._finish_host_copy(action_host)
+            )
 
             if done:
                 next_state = self.env.reset()
@@ -160,12 +203,7 @@ class PPO:
             next_state = self._to_tensor(next_state)
 
             # Store the transition
-            states.append(self.state)
-            actions.append(action)
-            rewards.append(reward)
-            log_probs.append(log_prob)
-            values.append(value)
-            dones.append(done)
+            memory.push(self.state, action, log_prob, reward, value, done)
 
             self.state = next_state
 
@@ -174,26 +212,35 @@ class PPO:
             if delay_ms > 0:
                 sleep(delay_ms / 1000)
 
-        # Get value of last state (used in GAE)
-        final_value, _, _ = self.net(self.state)
-        final_value = final_value.squeeze(0)
+        memory.flush()
 
-        # Compute generalized advantage estimates
-        advantages = self._compute_gae(rewards, values, dones, final_value)
+        # Get value of last state (used in GAE), the policy heads are not needed here
+        final_value = self._rollout_forward(self.state, value_only=True)
+        final_value = final_value.squeeze()
 
-        # Convert to tensors
-        states = torch.cat(states)
-        actions = torch.stack(actions)
-        log_probs = torch.stack(log_probs)
-        advantages = torch.tensor(advantages, dtype=torch.float32, device=device)
-        rewards = torch.tensor(rewards, dtype=torch.float32, device=device)
-        values = torch.cat(values)
+        # Compute generalized advantage estimates
+        self._compute_gae(memory, final_value)
 
-        return Memory(states, actions, log_probs, rewards, advantages, values)
+        return memory
 
     def save(self, filepath: str):
         torch.save(self.net.state_dict(), filepath)
 
+    def save_async(self, filepath: str):
+        # Snapshot the weights on the host, then write the file off the training loop
+        state_dict = {
+            k: v.detach().to("cpu", copy=True) for k, v in self.net.state_dict().items()
+        }
+
+        self.wait_for_save()
+        self.pending_save = self.save_executor.submit(torch.save, state_dict, filepath)
+
+    def wait_for_save(self):
+        if self.pending_save is not None:
+            pending_save, self.pending_save = self.pending_save, None
+            # re-raises any error from the background save
+            pending_save.result()
+
     def load(self, filepath: str):
         self.net.load_state_dict(torch.load(filepath))
 
@@ -201,15 +248,46 @@ class PPO:
         self, state: np.ndarray
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         state = self._to_tensor(state)
-        value, alpha, beta = self.net(state)
+        value, alpha, beta = self.net(self._dequantize(state))
         return value, alpha, beta
 
-    def _compute_gae(self, rewards, values, dones, last_value):
-        advantages = [0] * len(rewards)
+    def _start_host_copy(self, x):
+        if self.transfer_stream is None:
+            return x.cpu()
+
+        # Copy on the side stream once x is ready, without blocking the default stream
+        self.transfer_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(self.transfer_stream):
+            x_host = x.to("cpu", non_blocking=True)
+        x.record_stream(self.transfer_stream)
+
+        return x_host
+
+    def _finish_host_copy(self, x_host):
+        if self.transfer_stream is not None:
+            self.transfer_stream.synchronize()
+
+        return x_host.numpy()
+
+    def _rollout_forward(self, state, value_only=False):
+        with torch.autocast(
+            device_type=device.type, dtype=torch.bfloat16, enabled=self.mixed_precision
+        ):
+            if value_only:
+                return self.net.value(self._dequantize(state)).float()
+
+            value, alpha, beta = self.net(self._dequantize(state))
+
+        # Distributions and stored rollout values stay in float32
+        return value.float(), alpha.float(), beta.float()
+
+    def _compute_gae(self, memory, last_value):
+        rewards, values, dones = memory.rewards, memory.values, memory.dones
+        advantages = memory.advantages
 
         last_advantage = 0
 
-        for i in reversed(range(len(rewards))):
+        for i in reversed(range(len(memory))):
             delta = rewards[i] + (1 - dones[i]) * self.gamma * last_value - values[i]
             advantages[i] = (
                 delta + (1 - dones[i]) * self.gamma * self.gae_lambda * last_advantage
@@ -218,10 +296,15 @@ class PPO:
             last_value = values[i]
             last_advantage = advantages[i]
 
-        return advantages
-
     def _to_tensor(self, x):
-        return torch.tensor(x, dtype=torch.float32, device=device).unsqueeze(0)
+        return torch.as_tensor(x, dtype=self.state_dtype, device=device).unsqueeze(0)
+
+    def _dequantize(self, states):
+        # uint8 states are only converted to [0, 1] floats on the device, right before the net
+        if states.dtype == torch.uint8:
+            return states.float().mul_(1 / 255.0)
+
+        return states
 
     def _set_step_params(self, step):
         # interpolate self.alpha between 1.0 and 0.0
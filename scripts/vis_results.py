@@ -33,6 +33,9 @@ def main():
 
         rgb = env.render(mode="rgb_array")
 
+        # the rollout runs in inference mode; clone so the activations can be scaled in place
+        activations = activations.clone()
+
         global_avg = torch.mean(activations, dim=[0, 2, 3])
 
         for i in range(activations.shape[1]):